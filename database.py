@@ -1,7 +1,8 @@
 import sqlite3
 from pathlib import Path
-from typing import Dict, List, Optional
-import os, uuid, hashlib, time
+from typing import Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+import os, hashlib, hmac, time, threading, json, weakref
 
 DB_PATH = "DB/app.db"
 
@@ -33,7 +34,7 @@ CREATE TABLE IF NOT EXISTS user_ledgers (
     ON DELETE CASCADE ON UPDATE CASCADE,
   FOREIGN KEY (ledger_id) REFERENCES ledgers(ledger_id)
     ON DELETE CASCADE ON UPDATE CASCADE
-);
+) WITHOUT ROWID;
 """,
     "transactions": """
 CREATE TABLE IF NOT EXISTS transactions (
@@ -58,7 +59,7 @@ CREATE TABLE IF NOT EXISTS user_transactions (
     ON DELETE CASCADE ON UPDATE CASCADE,
   FOREIGN KEY (transaction_id) REFERENCES transactions(transaction_id)
     ON DELETE CASCADE ON UPDATE CASCADE
-);
+) WITHOUT ROWID;
 """
 }
 
@@ -67,151 +68,443 @@ def uuid7() -> str:
     生成 UUIDv7（基于时间的可排序 UUID），返回字符串形式。
     Python 3.11+ 可直接用 uuid.uuid7()。
     """
-    # 当前时间戳（毫秒）
-    ts_ms = int(time.time() * 1000)
-    # 48 位时间戳，高位放前
-    time_high = (ts_ms >> 28) & 0xFFFFFFFF
-    time_mid = (ts_ms >> 12) & 0xFFFF
-    time_low = ts_ms & 0xFFF
-
-    rand_a = int.from_bytes(os.urandom(2), "big")
-    rand_b = int.from_bytes(os.urandom(6), "big")
-
-    # 拼接成 128bit
-    msb = (time_high << 32) | (time_mid << 16) | (0x7000 | time_low)  # 版本 7
-    lsb = (rand_a << 48) | rand_b
-    return str(uuid.UUID(int=((msb << 64) | lsb)))
+    # 48 位毫秒时间戳（大端）在前，其后 80 位随机数，一次 urandom 取齐
+    buf = bytearray(16)
+    buf[:6] = int(time.time() * 1000).to_bytes(6, "big")
+    buf[6:] = os.urandom(10)
+    buf[6] = (buf[6] & 0x0F) | 0x70  # 版本 7
+    buf[8] = (buf[8] & 0x3F) | 0x80  # RFC 4122 变体
+    # 直接拼 8-4-4-4-12 格式，省去 uuid.UUID 的构造与校验
+    h = buf.hex()
+    return f"{h[0:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:32]}"
+
+# (秒, "YYYY-MM-DD", "YYYY-MM-DD HH:MM:SS")；整体替换一个元组，多线程下不会读到半更新的值
+_now_cache: Tuple[int, str, str] = (-1, "", "")
+
+def _now_strings() -> Tuple[str, str]:
+    """
+    返回当前 UTC 的 (日期, 日期时间) 字符串；同一秒内复用上次格式化结果。
+    """
+    global _now_cache
+    sec = int(time.time())
+    cache = _now_cache
+    if cache[0] != sec:
+        t = time.gmtime(sec)
+        cache = _now_cache = (
+            sec, time.strftime("%Y-%m-%d", t), time.strftime("%Y-%m-%d %H:%M:%S", t)
+        )
+    return cache[1], cache[2]
 
 INDEXES: List[str] = [
+    # login 按 user_name 查找；唯一索引同时保证用户名不重复
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_name ON users(user_name);",
     "CREATE INDEX IF NOT EXISTS idx_ledgers_creator ON ledgers(creator_id);",
-    "CREATE INDEX IF NOT EXISTS idx_tx_ledger       ON transactions(ledger_id);",
+    # compute_expense 按 ledger_id 汇总 price：覆盖索引，只读索引不回表
+    "CREATE INDEX IF NOT EXISTS idx_tx_ledger_price ON transactions(ledger_id, price);",
     "CREATE INDEX IF NOT EXISTS idx_tx_payer        ON transactions(payer_id);",
     "CREATE INDEX IF NOT EXISTS idx_ul_ledger       ON user_ledgers(ledger_id);",
     "CREATE INDEX IF NOT EXISTS idx_ut_tx           ON user_transactions(transaction_id);",
 ]
 
+# 表结构迁移：(目标表, SQL)，全部执行后 user_version = len(MIGRATIONS)。
+# 只对库中原本就存在的表执行；本次新建的表已是 SCHEMAS 中的最新结构。
+# 已发布的迁移内容固定为字面量，不得引用 SCHEMAS（SCHEMAS 以后改动不应改变旧迁移）。
+MIGRATIONS: List[Tuple[str, str]] = [
+    # 1. 纯联结表改为 WITHOUT ROWID（去掉隐藏 rowid 及其 b-tree）；ALTER TABLE 做不到，重建
+    ("user_ledgers", """
+CREATE TABLE user_ledgers__new (
+  user_id   TEXT NOT NULL,
+  ledger_id TEXT NOT NULL,
+  PRIMARY KEY (user_id, ledger_id),
+  FOREIGN KEY (user_id)  REFERENCES users(user_id)
+    ON DELETE CASCADE ON UPDATE CASCADE,
+  FOREIGN KEY (ledger_id) REFERENCES ledgers(ledger_id)
+    ON DELETE CASCADE ON UPDATE CASCADE
+) WITHOUT ROWID;
+INSERT INTO user_ledgers__new (user_id, ledger_id)
+  SELECT user_id, ledger_id FROM user_ledgers;
+DROP TABLE user_ledgers;
+ALTER TABLE user_ledgers__new RENAME TO user_ledgers;
+"""),
+    # 2. 同上
+    ("user_transactions", """
+CREATE TABLE user_transactions__new (
+  user_id        TEXT NOT NULL,
+  transaction_id TEXT NOT NULL,
+  PRIMARY KEY (user_id, transaction_id),
+  FOREIGN KEY (user_id)        REFERENCES users(user_id)
+    ON DELETE CASCADE ON UPDATE CASCADE,
+  FOREIGN KEY (transaction_id) REFERENCES transactions(transaction_id)
+    ON DELETE CASCADE ON UPDATE CASCADE
+) WITHOUT ROWID;
+INSERT INTO user_transactions__new (user_id, transaction_id)
+  SELECT user_id, transaction_id FROM user_transactions;
+DROP TABLE user_transactions;
+ALTER TABLE user_transactions__new RENAME TO user_transactions;
+"""),
+    # 3. idx_tx_ledger(ledger_id) 已是 INDEXES 中 idx_tx_ledger_price 的前缀，删除以减少写放大
+    ("transactions", "DROP INDEX IF EXISTS idx_tx_ledger;\n"),
+]
+
+# 连接级 PRAGMA：只对当前连接生效，每条连接都要设置
+# （journal_mode=WAL 是持久化到库文件的，由读写连接单独设置；只读连接无法修改它）
+PRAGMAS = """
+PRAGMA foreign_keys = ON;
+PRAGMA busy_timeout = 3000;
+PRAGMA synchronous = NORMAL;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -65536;
+PRAGMA mmap_size = 268435456;
+"""
+
+# 已初始化过的 db_path（按 os.path.abspath 归一，相对路径以调用时的 cwd 为准）
+# -> resolve 后的路径；再次调用时跳过 mkdir/resolve
+_initialized: Dict[str, str] = {}
+
 def CreateDB(db_path: str = "app.db") -> dict:
     """
     初始化/补全多人记账系统数据库。
     - 若表已存在则跳过，仅创建缺失项
+    - 按 PRAGMA user_version 执行尚未应用的 MIGRATIONS
     - 开启 foreign_keys、WAL 等基础 PRAGMA
     返回:
         {
           "db_path": "...",
           "existed": [...],
           "created": [...],
+          "migrated": N,
           "indexes_created": N
         }
+    :raises sqlite3.IntegrityError: users 中已有重复 user_name 时（数据库保持不变）
+    :raises sqlite3.OperationalError: 库的 user_version 高于本版本的迁移数时（数据库保持不变）
     """
-    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(db_path)
+    abs_path = os.path.abspath(db_path)
+    resolved = _initialized.get(abs_path)
+    if resolved is None:
+        Path(abs_path).parent.mkdir(parents=True, exist_ok=True)
+        resolved = str(Path(abs_path).resolve())
+        conn = sqlite3.connect(abs_path)
+    else:
+        try:
+            conn = sqlite3.connect(abs_path)
+        except sqlite3.OperationalError:
+            # 缓存命中但目录已被删除：补建目录后重试；其余情况原样抛出
+            Path(abs_path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(abs_path)
     try:
-        conn.execute("PRAGMA foreign_keys = ON;")
         conn.execute("PRAGMA journal_mode = WAL;")
-        conn.execute("PRAGMA synchronous = NORMAL;")
-        conn.execute("PRAGMA busy_timeout = 3000;")
+        conn.executescript(PRAGMAS)
 
-        # 查询现有表
+        # 查询现有表与索引
         cur = conn.execute(
-            "SELECT name FROM sqlite_master WHERE type='table';"
+            "SELECT type, name FROM sqlite_master WHERE type IN ('table', 'index');"
         )
-        existing = {row[0] for row in cur.fetchall()}
-
+        rows = cur.fetchall()
+        existing = {name for kind, name in rows if kind == "table"}
+        existing_indexes = {name for kind, name in rows if kind == "index"}
+
+        # 唯一索引 idx_users_name 建立前先检查重复用户名，
+        # 有重复则在改动任何东西之前报错，并列出重复项
+        if "users" in existing and "idx_users_name" not in existing_indexes:
+            dup_names = [row[0] for row in conn.execute(
+                "SELECT user_name FROM users GROUP BY 1 HAVING COUNT(*) > 1;"
+            ).fetchall()]
+            if dup_names:
+                raise sqlite3.IntegrityError(
+                    "duplicate user_name prevents creating unique index "
+                    f"idx_users_name: {dup_names}"
+                )
+
+        version = conn.execute("PRAGMA user_version;").fetchone()[0]
+        # 由更新版本的程序迁移过的库：本版本不认识其结构，拒绝处理
+        if version > len(MIGRATIONS):
+            raise sqlite3.OperationalError(
+                f"database schema version {version} is newer than supported "
+                f"version {len(MIGRATIONS)}"
+            )
+
+        # 收集本次要执行的 DDL，最后在一个事务里一次性执行
+        ddl = []
         created = []
         # 按依赖顺序建表：users -> ledgers -> user_ledgers -> transactions -> user_transactions
         order = ["users", "ledgers", "user_ledgers", "transactions", "user_transactions"]
         for name in order:
             if name not in existing:
-                conn.executescript(SCHEMAS[name])
+                ddl.append(SCHEMAS[name])
                 created.append(name)
 
-        # 索引
-        idx_created = 0
-        for stmt in INDEXES:
-            conn.execute(stmt)
-            idx_created += 1
+        # 迁移：只对原本就存在的表执行
+        migrated = 0
+        for table, script in MIGRATIONS[version:]:
+            if table in existing:
+                ddl.append(script)
+                migrated += 1
+        if version < len(MIGRATIONS):
+            ddl.append(f"PRAGMA user_version = {len(MIGRATIONS)};")
 
-        conn.commit()
+        # 索引
+        ddl.extend(INDEXES)
+        idx_created = len(INDEXES)
+
+        conn.executescript("BEGIN;\n" + "\n".join(ddl) + "\nCOMMIT;")
+        # 新建了表说明库文件是新的（或被替换过），丢弃指向旧文件的缓存连接
+        if created:
+            _evict(db_path)
+        _initialized[abs_path] = resolved
         return {
-            "db_path": str(Path(db_path).resolve()),
+            "db_path": resolved,
             "existed": sorted(existing.intersection(set(order))),
             "created": created,
+            "migrated": migrated,
             "indexes_created": idx_created
         }
     finally:
         conn.close()
 
+# ---------- SQL 语句 ----------
+# 固定的模块级字符串：sqlite3 的语句缓存按 SQL 文本命中，避免每次调用重新 prepare
+SQL_INSERT_USER = "INSERT INTO users (user_id, user_name, hashed_password) VALUES (?, ?, ?);"
+SQL_SELECT_USER_BY_NAME = "SELECT user_id, hashed_password FROM users WHERE user_name = ? LIMIT 1;"
+SQL_SELECT_USER_NAME = "SELECT user_name FROM users WHERE user_id = ? LIMIT 1;"
+SQL_INSERT_LEDGER = (
+    "INSERT INTO ledgers (ledger_id, creator_id, ledger_name, create_time) VALUES (?, ?, ?, ?);"
+)
+SQL_LEDGER_EXISTS = "SELECT 1 FROM ledgers WHERE ledger_id = ? LIMIT 1;"
+SQL_INSERT_TX = (
+    "INSERT INTO transactions"
+    " (transaction_id, ledger_id, payer_id, price, description, payment_time)"
+    " VALUES (?, ?, ?, ?, ?, ?);"
+)
+SQL_INSERT_USER_TX = "INSERT INTO user_transactions (user_id, transaction_id) VALUES (?, ?);"
+# 关联写入：只忽略主键重复（NOT NULL、外键等其他约束仍会报错）
+SQL_LINK_USER_LEDGER = (
+    "INSERT INTO user_ledgers (user_id, ledger_id) VALUES (?, ?)"
+    " ON CONFLICT (user_id, ledger_id) DO NOTHING;"
+)
+SQL_LINK_USER_TX = (
+    "INSERT INTO user_transactions (user_id, transaction_id) VALUES (?, ?)"
+    " ON CONFLICT (user_id, transaction_id) DO NOTHING;"
+)
+SQL_SUM_LEDGER = (
+    "SELECT COALESCE(SUM(CAST(ROUND(price * 100) AS INTEGER)), 0) "
+    "FROM transactions WHERE ledger_id = ?;"
+)
+# 账本行 + 关联用户合并为一次查询，首列 k 区分行类型：
+#   ('ledger', ledger_name, created_date, creator_id) / ('user', user_id, NULL, NULL)
+# created_date 直接由 SQLite 生成 "MM-YY"（如 "09-25"）；create_time 无法解析时为空字符串
+# （strftime 的 %y 需要 SQLite 3.46+，这里用 %Y 截取后两位以兼容旧版本）
+SQL_SELECT_LEDGER_INFO = """
+SELECT 'ledger' AS k, ledger_name,
+       COALESCE(strftime('%m-', create_time) || substr(strftime('%Y', create_time), 3), '')
+         AS created_date,
+       creator_id
+FROM ledgers WHERE ledger_id = ?1
+UNION ALL
+SELECT 'user', user_id, NULL, NULL FROM user_ledgers WHERE ledger_id = ?1;
+"""
+# 用户名 + 创建的账本 + 参与的账本合并为一次查询，首列 k 区分行类型
+SQL_SELECT_USER_INFO = """
+SELECT 'name' AS k, user_name AS v FROM users WHERE user_id = ?1
+UNION ALL
+SELECT 'own', ledger_id FROM ledgers WHERE creator_id = ?1
+UNION ALL
+SELECT 'join', ledger_id FROM user_ledgers WHERE user_id = ?1;
+"""
+# 参数为 ledger_id 的 JSON 数组：占位符个数固定，语句缓存不会因账本数量不同而失效
+SQL_SELECT_LEDGERS_WITH_USERS = """
+SELECT l.ledger_id, l.ledger_name,
+       COALESCE(strftime('%m-', l.create_time) || substr(strftime('%Y', l.create_time), 3), '')
+         AS created_date,
+       l.creator_id, ul.user_id
+FROM ledgers l
+LEFT JOIN user_ledgers ul ON ul.ledger_id = l.ledger_id
+WHERE l.ledger_id IN (SELECT value FROM json_each(?));
+"""
+
 # ---------- 连接工具 ----------
-def _connect(db_path: str) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path)
-    # 仅底层交互：开启外键与合理超时
-    conn.execute("PRAGMA foreign_keys = ON;")
-    conn.execute("PRAGMA busy_timeout = 3000;")
+# 写：每个 db_path 一条进程级写连接，由锁串行化（SQLite 本身同一时刻也只允许一个写者）
+# 读：每个线程按 db_path 缓存一条只读连接，WAL 下读不阻塞写
+_writers: Dict[str, Tuple[sqlite3.Connection, threading.Lock]] = {}
+_local = threading.local()
+# 各线程的 _ReaderSet；弱引用，线程结束后不会被这里留住
+_readers: "weakref.WeakSet[_ReaderSet]" = weakref.WeakSet()
+_conns_lock = threading.Lock()
+# 每条连接的预编译语句缓存容量（sqlite3 默认 128）
+STMT_CACHE_SIZE = 256
+# close_all() 后递增；线程发现代数变化时丢弃自己缓存的（已关闭）只读连接
+_generation = 0
+
+def _connect(db_path: str, readonly: bool = False) -> sqlite3.Connection:
+    # check_same_thread=False：写连接跨线程共享（由锁保护），
+    # 只读连接则是为了让 close_all() 能在其他线程关闭
+    if readonly:
+        uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(
+            uri, uri=True, check_same_thread=False, cached_statements=STMT_CACHE_SIZE
+        )
+    else:
+        # IMMEDIATE：事务开始即拿写锁，避免 DEFERRED 升级写锁时的 SQLITE_BUSY
+        conn = sqlite3.connect(
+            db_path,
+            isolation_level="IMMEDIATE",
+            check_same_thread=False,
+            cached_statements=STMT_CACHE_SIZE,
+        )
+        conn.execute("PRAGMA journal_mode = WAL;")
+    conn.executescript(PRAGMAS)
     return conn
 
+@contextmanager
+def _get_writer(db_path: str) -> Iterator[sqlite3.Connection]:
+    """
+    独占 db_path 的写连接并以 BEGIN IMMEDIATE 开启事务；
+    正常退出提交，异常回滚（不会关闭连接）。
+    """
+    with _conns_lock:
+        entry = _writers.get(db_path)
+        if entry is None:
+            entry = _writers[db_path] = (_connect(db_path), threading.Lock())
+    conn, lock = entry
+    with lock:
+        # 进入即拿写锁：块内的读写都在同一个 IMMEDIATE 事务里，
+        # 不会出现先读（共享锁）后写时升级失败的 SQLITE_BUSY；拿不到锁由 busy_timeout 等待
+        conn.execute("BEGIN IMMEDIATE;")
+        with conn:
+            yield conn
+
+def _close_conns(conns: Dict[str, sqlite3.Connection]) -> None:
+    for conn in list(conns.values()):
+        conn.close()
+    conns.clear()
+
+class _ReaderSet:
+    """
+    单个线程的只读连接（db_path -> Connection），挂在 _local 上；
+    线程结束、threading.local 清理掉它时由 finalize 关闭其中的连接。
+    """
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.conns: Dict[str, sqlite3.Connection] = {}
+        weakref.finalize(self, _close_conns, self.conns)
+
+def _get_reader(db_path: str) -> sqlite3.Connection:
+    """
+    取当前线程对应 db_path 的只读连接；首次访问时打开并设置 PRAGMA。
+    """
+    readers = getattr(_local, "readers", None)
+    if readers is None or readers.generation != _generation:
+        readers = _local.readers = _ReaderSet(_generation)
+        with _conns_lock:
+            _readers.add(readers)
+    conn = readers.conns.get(db_path)
+    if conn is None:
+        conn = readers.conns[db_path] = _connect(db_path, readonly=True)
+    return conn
+
+def _evict(db_path: str) -> None:
+    """
+    关闭 db_path 对应的缓存读写连接，下次访问时重新打开。
+    库文件被删除后重新创建时必须调用：旧连接仍指向已删除的文件，写入会静默丢失。
+    """
+    target = os.path.abspath(db_path)
+    with _conns_lock:
+        writers = [
+            _writers.pop(key) for key in list(_writers) if os.path.abspath(key) == target
+        ]
+        reader_sets = list(_readers)
+    for conn, lock in writers:
+        with lock:
+            conn.close()
+    for reader_set in reader_sets:
+        for key in list(reader_set.conns):
+            if os.path.abspath(key) == target:
+                conn = reader_set.conns.pop(key, None)
+                if conn is not None:
+                    conn.close()
+
+def close_all() -> None:
+    """
+    关闭所有缓存的读写连接（进程退出/测试清理时调用）。
+    """
+    global _generation
+    with _conns_lock:
+        writers = list(_writers.values())
+        readers = list(_readers)
+        _writers.clear()
+        _readers.clear()
+        _generation += 1
+    for conn, lock in writers:
+        with lock:
+            conn.close()
+    for reader_set in readers:
+        _close_conns(reader_set.conns)
+
+def _is_fk_error(e: sqlite3.IntegrityError) -> bool:
+    return "FOREIGN KEY constraint failed" in str(e)
+
 # ---------- 1) 注册：register(user_name, hashed_password) ----------
 def register_user(db_path: str, user_name: str, hashed_password: str) -> str:
     """
-    新建用户（不做任何业务校验/去重校验；冲突将抛出 sqlite3.IntegrityError）
+    新建用户（不做任何业务校验；user_name 重复由唯一索引拒绝，抛出 sqlite3.IntegrityError）
     :return: user_id (uuid7)
     """
     user_id = uuid7()
-    with _connect(db_path) as conn:
-        conn.execute(
-            "INSERT INTO users (user_id, user_name, hashed_password) VALUES (?, ?, ?);",
-            (user_id, user_name, hashed_password),
-        )
+    with _get_writer(db_path) as conn:
+        conn.execute(SQL_INSERT_USER, (user_id, user_name, hashed_password))
     return user_id
 
 # ---------- 2) 登陆：login(user_name, hashed_password) ----------
 def login(db_path: str, user_name: str, hashed_password: str) -> str | None:
     """
-    仅比对哈希是否一致；一致返回 user_id，不一致/不存在返回 None
+    仅比对哈希是否一致（常量时间比较）；一致返回 user_id，不一致/不存在返回 None
     """
-    with _connect(db_path) as conn:
-        row = conn.execute(
-            "SELECT user_id, hashed_password FROM users WHERE user_name = ? LIMIT 1;",
-            (user_name,),
-        ).fetchone()
+    conn = _get_reader(db_path)
+    row = conn.execute(SQL_SELECT_USER_BY_NAME, (user_name,)).fetchone()
     if not row:
         return None
     user_id, stored_hash = row
-    return user_id if stored_hash == hashed_password else None
+    # 编码为 bytes：compare_digest 不接受含非 ASCII 字符的 str
+    if hmac.compare_digest(stored_hash.encode(), hashed_password.encode()):
+        return user_id
+    return None
 
 # ---------- 3) 添加账本：add_ledger(user_id) ----------
-def add_ledger(db_path: str, user_id: str, ledger_name: str | None = None) -> str:
+def add_ledger(
+    db_path: str,
+    user_id: str,
+    ledger_name: str | None = None,
+    creator_name: str | None = None,
+) -> str:
     """
     创建账本:
       - ledger_id 使用 uuid7
       - ledger_name 可选；若 None/空，则设为 "{user_name} 的账本 YYYY-MM-DD"
+      - creator_name 可选：调用方已知的创建者 user_name，仅用于生成默认账本名；
+        提供后不再查询 users 表
       - create_time 自动写入当前 UTC 时间 "YYYY-MM-DD HH:MM:SS"
     返回 ledger_id
     """
     ledger_id = uuid7()
-    now_date = time.strftime("%Y-%m-%d", time.gmtime())
-    now_datetime = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-
-    with _connect(db_path) as conn:
-        # 取 user_name
-        row = conn.execute(
-            "SELECT user_name FROM users WHERE user_id = ? LIMIT 1;", (user_id,)
-        ).fetchone()
-        if not row:
-            raise sqlite3.OperationalError("user_id not found")
-        creator_name = row[0]
-
-        # 生成默认账本名
-        if not ledger_name or ledger_name.strip() == "":
-            ledger_name = f"{creator_name} 的账本 {now_date}"
-
-        # 插入
-        conn.execute(
-            """
-            INSERT INTO ledgers (ledger_id, creator_id, ledger_name, create_time)
-            VALUES (?, ?, ?, ?);
-            """,
-            (ledger_id, user_id, ledger_name, now_datetime),
-        )
+    now_date, now_datetime = _now_strings()
+
+    # 生成默认账本名（只有这时且调用方未提供 creator_name 才需要查 user_name）
+    if not ledger_name or ledger_name.strip() == "":
+        if creator_name is None:
+            row = _get_reader(db_path).execute(SQL_SELECT_USER_NAME, (user_id,)).fetchone()
+            if not row:
+                raise sqlite3.OperationalError("user_id not found")
+            creator_name = row[0]
+        ledger_name = f"{creator_name} 的账本 {now_date}"
+
+    # 插入；user_id 是否存在由外键检查
+    try:
+        with _get_writer(db_path) as conn:
+            conn.execute(SQL_INSERT_LEDGER, (ledger_id, user_id, ledger_name, now_datetime))
+    except sqlite3.IntegrityError as e:
+        # ledgers 只有 creator_id 一个外键
+        if _is_fk_error(e):
+            raise sqlite3.OperationalError("user_id not found") from e
+        raise
 
     return ledger_id
 
@@ -228,76 +521,87 @@ def add_transaction(
     创建交易记录：
       - ledger_id 必须存在
       - payer_id 必须存在
-      - price 金额（浮点型，精度由上层保证）
+      - price 金额（浮点型，精度由上层保证；汇总时按分取整）
       - description 描述，可为空
       - payment_time 可选；若 None，则默认当前 UTC 日期 YYYY-MM-DD
       - 自动写入 user_transactions，把 payer_id 与该交易关联
     返回 transaction_id (uuid7)
     """
-    tx_id = uuid7()
-    if payment_time is None:
-        payment_time = time.strftime("%Y-%m-%d", time.gmtime())
-
-    with _connect(db_path) as conn:
-        # 检查账本存在（外键也会检查，但这里可提前明确）
-        row = conn.execute(
-            "SELECT 1 FROM ledgers WHERE ledger_id = ? LIMIT 1;", (ledger_id,)
-        ).fetchone()
-        if not row:
-            raise sqlite3.OperationalError("ledger_id not found")
-
-        # 插入交易
-        conn.execute(
-            """
-            INSERT INTO transactions
-              (transaction_id, ledger_id, payer_id, price, description, payment_time)
-            VALUES (?, ?, ?, ?, ?, ?);
-            """,
-            (tx_id, ledger_id, payer_id, price, description, payment_time),
-        )
+    return add_transactions_bulk(
+        db_path, ledger_id, [(payer_id, price, description, payment_time)]
+    )[0]
 
-        # 自动添加交易关联（付款人参与交易）
-        conn.execute(
-            "INSERT INTO user_transactions (user_id, transaction_id) VALUES (?, ?);",
-            (payer_id, tx_id),
-        )
+# ---------- 4.1) 批量添加交易：add_transactions_bulk(ledger_id, rows) ----------
+def add_transactions_bulk(
+    db_path: str,
+    ledger_id: str,
+    rows: List[Tuple[str, float, Optional[str], Optional[str]]],
+) -> List[str]:
+    """
+    在同一账本下批量创建交易（单个事务内 executemany，一次提交）：
+      - rows 每项为 (payer_id, price, description, payment_time)，含义同 add_transaction
+      - ledger_id / payer_id 由外键检查；任一行失败则整批回滚
+      - 每笔交易都自动写入 user_transactions（付款人参与交易）
+    返回 transaction_id 列表（与 rows 顺序一致）
+    """
+    today, _ = _now_strings()
+    tx_ids = []
+    tx_rows = []
+    link_rows = []
+    for payer_id, price, description, payment_time in rows:
+        tx_id = uuid7()
+        tx_ids.append(tx_id)
+        tx_rows.append((
+            tx_id, ledger_id, payer_id, price, description,
+            today if payment_time is None else payment_time,
+        ))
+        link_rows.append((payer_id, tx_id))
 
-    return tx_id
+    try:
+        with _get_writer(db_path) as conn:
+            conn.executemany(SQL_INSERT_TX, tx_rows)
+            conn.executemany(SQL_INSERT_USER_TX, link_rows)
+    except sqlite3.IntegrityError as e:
+        # 外键失败时才查一次，区分账本不存在（OperationalError）与付款人不存在（原样抛出）
+        if _is_fk_error(e):
+            row = _get_reader(db_path).execute(SQL_LEDGER_EXISTS, (ledger_id,)).fetchone()
+            if not row:
+                raise sqlite3.OperationalError("ledger_id not found") from e
+        raise
+
+    return tx_ids
 
 # ---------- 5) 计算支出：compute_expense(ledger_id) ----------
 def compute_expense(db_path: str, ledger_id: str) -> float:
     """
-    返回该账本下所有交易 price 之和（None 视为 0）。
-    （不做币种/精度处理，上层可自行用 Decimal）
+    返回该账本下所有交易 price 之和（无交易为 0）。
+    每笔按分取整后以整数求和再换算，精度为 0.01；不做币种处理
     """
-    with _connect(db_path) as conn:
-        row = conn.execute(
-            "SELECT COALESCE(SUM(price), 0) FROM transactions WHERE ledger_id = ?;",
-            (ledger_id,),
-        ).fetchone()
-    return float(row[0]) if row else 0.0
+    conn = _get_reader(db_path)
+    row = conn.execute(SQL_SUM_LEDGER, (ledger_id,)).fetchone()
+    return row[0] / 100.0 if row else 0.0
 
 # ---------- 6) 为账本添加关联用户：link_user_to_ledger(ledger_id, user_id) ----------
-def link_user_to_ledger(db_path: str, ledger_id: str, user_id: str) -> None:
+def link_user_to_ledger(db_path: str, ledger_id: str, user_id: str) -> int:
     """
-    在 user_ledgers 写一条关联（重复插入将触发主键冲突；外键不匹配会抛错）
+    在 user_ledgers 写一条关联（已存在则忽略，不再抛主键冲突；空值/外键不匹配会抛错）
+    :return: 新写入的行数（1 = 新关联，0 = 关联已存在）
     """
-    with _connect(db_path) as conn:
-        conn.execute(
-            "INSERT INTO user_ledgers (user_id, ledger_id) VALUES (?, ?);",
-            (user_id, ledger_id),
-        )
+    with _get_writer(db_path) as conn:
+        before = conn.total_changes
+        conn.execute(SQL_LINK_USER_LEDGER, (user_id, ledger_id))
+        return conn.total_changes - before
 
 # ---------- 7) 为交易添加关联用户：link_user_to_transaction(transaction_id, user_id) ----------
-def link_user_to_transaction(db_path: str, transaction_id: str, user_id: str) -> None:
+def link_user_to_transaction(db_path: str, transaction_id: str, user_id: str) -> int:
     """
-    在 user_transactions 写一条关联（重复/外键问题交由数据库报错）
+    在 user_transactions 写一条关联（已存在则忽略；空值/外键问题交由数据库报错）
+    :return: 新写入的行数（1 = 新关联，0 = 关联已存在）
     """
-    with _connect(db_path) as conn:
-        conn.execute(
-            "INSERT INTO user_transactions (user_id, transaction_id) VALUES (?, ?);",
-            (user_id, transaction_id),
-        )
+    with _get_writer(db_path) as conn:
+        before = conn.total_changes
+        conn.execute(SQL_LINK_USER_TX, (user_id, transaction_id))
+        return conn.total_changes - before
 
 # ---------- 8) 获取账本信息：get_ledger_info(ledger_id) ----------
 def get_ledger_info(db_path: str, ledger_id: str) -> dict:
@@ -309,38 +613,25 @@ def get_ledger_info(db_path: str, ledger_id: str) -> dict:
 
     :raises sqlite3.OperationalError: 当 ledger_id 不存在时
     """
-    with _connect(db_path) as conn:
-        row = conn.execute(
-            "SELECT ledger_name, create_time, creator_id FROM ledgers WHERE ledger_id = ? LIMIT 1;",
-            (ledger_id,),
-        ).fetchone()
-
-        if not row:
-            raise sqlite3.OperationalError("ledger_id not found")
-
-        ledger_name, create_time, creator_id = row
-
-        # 收集关联用户（来自 user_ledgers）
-        users = {u[0] for u in conn.execute(
-            "SELECT user_id FROM user_ledgers WHERE ledger_id = ?;",
-            (ledger_id,)
-        ).fetchall()}
-
-        # 确保将创建者也计入 involved_user（即使未写入 user_ledgers）
-        users.add(creator_id)
-
-    # 生成 "MM-YY" 的 created_date
-    # create_time 约定为 "YYYY-MM-DD HH:MM:SS"（或至少以 "YYYY-MM" 开头）
-    s = (create_time or "").strip()
-    # 取出 "YYYY-MM" 前 7 个字符
-    yymm = s[:7] if len(s) >= 7 else ""
-    if len(yymm) == 7 and yymm[4] == "-":
-        yyyy = yymm[:4]
-        mm = yymm[5:7]
-        created_date = f"{mm}-{yyyy[-2:]}"
-    else:
-        # 兜底：无法解析时给空字符串
-        created_date = ""
+    conn = _get_reader(db_path)
+    ledger_row = None
+    users = set()
+    for k, v, created_date, creator_id in conn.execute(
+        SQL_SELECT_LEDGER_INFO, (ledger_id,)
+    ):
+        if k == "ledger":
+            ledger_row = (v, created_date, creator_id)
+        else:
+            # 收集关联用户（来自 user_ledgers）
+            users.add(v)
+
+    if not ledger_row:
+        raise sqlite3.OperationalError("ledger_id not found")
+
+    ledger_name, created_date, creator_id = ledger_row
+
+    # 确保将创建者也计入 involved_user（即使未写入 user_ledgers）
+    users.add(creator_id)
 
     return {
         "ledger_name": ledger_name,
@@ -354,42 +645,43 @@ def get_user_info(db_path: str, user_id: str) -> dict:
     获取用户信息:
       - user_name: 来自 users 表
       - ledgers: 该用户参与的所有账本（包括自己创建的 + user_ledgers 关联的）
-                 每个元素通过复用 get_ledger_info 返回结构
+                 每个元素与 get_ledger_info 返回结构相同
     :raises sqlite3.OperationalError: 当 user_id 不存在时
     """
-    with _connect(db_path) as conn:
-        row = conn.execute(
-            "SELECT user_name FROM users WHERE user_id = ? LIMIT 1;", (user_id,)
-        ).fetchone()
-        if not row:
-            raise sqlite3.OperationalError("user_id not found")
-        user_name = row[0]
-
-        # 1. 作为创建者的账本
-        creator_ledgers = {
-            r[0] for r in conn.execute(
-                "SELECT ledger_id FROM ledgers WHERE creator_id = ?;", (user_id,)
-            ).fetchall()
-        }
+    conn = _get_reader(db_path)
+    user_name = None
+    # 作为创建者的账本 + 通过 user_ledgers 参与的账本，合并去重
+    all_ledgers = set()
+    for k, v in conn.execute(SQL_SELECT_USER_INFO, (user_id,)):
+        if k == "name":
+            user_name = v
+        else:
+            all_ledgers.add(v)
+
+    if user_name is None:
+        raise sqlite3.OperationalError("user_id not found")
+
+    # 一次 JOIN 取回所有账本及其关联用户，按 ledger_id 分组
+    # （已被删除的账本不会出现在结果中，自然跳过）
+    grouped: Dict[str, tuple] = {}
+    for lid, ledger_name, created_date, creator_id, member_id in conn.execute(
+        SQL_SELECT_LEDGERS_WITH_USERS, (json.dumps(sorted(all_ledgers)),)
+    ):
+        entry = grouped.get(lid)
+        if entry is None:
+            # 确保将创建者也计入 involved_user（即使未写入 user_ledgers）
+            entry = grouped[lid] = (ledger_name, created_date, {creator_id})
+        if member_id is not None:
+            entry[2].add(member_id)
 
-        # 2. 通过 user_ledgers 参与的账本
-        joined_ledgers = {
-            r[0] for r in conn.execute(
-                "SELECT ledger_id FROM user_ledgers WHERE user_id = ?;", (user_id,)
-            ).fetchall()
-        }
-
-        # 合并去重
-        all_ledgers = creator_ledgers.union(joined_ledgers)
-
-    # 复用 get_ledger_info
     ledgers_info = []
-    for lid in sorted(all_ledgers):
-        try:
-            ledgers_info.append(get_ledger_info(db_path, lid))
-        except sqlite3.OperationalError:
-            # 如果账本已被删除，跳过
-            continue
+    for lid in sorted(grouped):
+        ledger_name, created_date, users = grouped[lid]
+        ledgers_info.append({
+            "ledger_name": ledger_name,
+            "involved_user": sorted(users),
+            "created_date": created_date,
+        })
 
     return {
         "user_name": user_name,